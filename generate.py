@@ -1,4 +1,7 @@
 import sys
+import heapq
+import operator
+import itertools
 import collections
 
 from crossword import *
@@ -11,19 +14,104 @@ class CrosswordCreator():
         Create new CSP crossword generate.
         """
         self.crossword = crossword
+        # bucket the vocabulary by length once; each variable only ever
+        # needs a copy of the bucket matching its own length
+        words_by_length = collections.defaultdict(set)
+        for word in self.crossword.words:
+            words_by_length[len(word)].add(word)
         self.domains = {
-            var: self.crossword.words.copy()
+            var: set(words_by_length[var.length])
             for var in self.crossword.variables
         }
+        # inverted index over each domain: self.index[var][k][letter] is the
+        # set of words in `self.domains[var]` with `letter` at position `k`;
+        # letters with no words left are dropped from the position's dict;
+        # it is built once per word length and copied for each variable
+        templates = {}
+        self.index = {}
+        for var in self.crossword.variables:
+            if var.length not in templates:
+                positions = [dict() for _ in range(var.length)]
+                for word in words_by_length[var.length]:
+                    for k, letter in enumerate(word):
+                        positions[k].setdefault(letter, set()).add(word)
+                templates[var.length] = positions
+            self.index[var] = [
+                {letter: set(words) for letter, words in position.items()}
+                for position in templates[var.length]
+            ]
+        # the puzzle structure never changes, so compute neighbors only once
+        self._neighbors = {
+            var: frozenset(self.crossword.neighbors(var))
+            for var in self.crossword.variables
+        }
+        # (neighbor, i, j) for every neighbor of each variable, where i and j
+        # are the overlapping positions, so hot loops never look up overlaps
+        self._constraints = {
+            var: tuple(
+                (neighbor, *self.crossword.overlaps[var, neighbor])
+                for neighbor in self._neighbors[var]
+            )
+            for var in self.crossword.variables
+        }
+        # stack of frames, one per search decision; each frame records a
+        # (variable, removed values, replaced index or None) triple for every
+        # prune made since it was pushed
+        self.trail = []
+        # heap of (domain size, -degree, tiebreak, var) for MRV selection;
+        # entries are pushed on every domain change and skipped when stale,
+        # and remaining ties go to the variable whose entry is oldest
+        self._deg = {var: len(self._neighbors[var]) for var in self._neighbors}
+        self._tiebreak = itertools.count()
+        self._heap = []
+        for var in self.crossword.variables:
+            self.push_variable(var)
+        self._build_revise_fns()
+        # scratch grid reused by letter_grid() across print/save calls
+        self._grid_buf = [
+            [None for _ in range(self.crossword.width)]
+            for _ in range(self.crossword.height)
+        ]
+
+    def _build_revise_fns(self):
+        """
+        Build `self._revise_fn`, mapping each overlapping arc (x, y) to a
+        function that revises `x` against `y` with the overlap positions
+        bound in, so the overlap lookup is paid once per arc rather than
+        once per revision.
+        """
+        index = self.index
+        prune = self.prune
+
+        def specialize(x, y, i, j):
+            def revise_arc():
+                # drop every letter bucket of `x` that `y` cannot match
+                supported = index[y][j]
+                removed = set()
+                for letter, words in index[x][i].items():
+                    if letter not in supported:
+                        removed |= words
+                if not removed:
+                    return False
+                prune(x, removed)
+                return True
+            return revise_arc
+
+        self._revise_fn = {
+            (x, y): specialize(x, y, *overlap)
+            for (x, y), overlap in self.crossword.overlaps.items()
+            if overlap is not None
+        }
 
     def letter_grid(self, assignment):
         """
         Return 2D array representing a given assignment.
+        The array is reused and overwritten by the next call.
         """
-        letters = [
-            [None for _ in range(self.crossword.width)]
-            for _ in range(self.crossword.height)
-        ]
+        letters = self._grid_buf
+        for row in letters:
+            for j in range(len(row)):
+                row[j] = None
         for variable, word in assignment.items():
             direction = variable.direction
             for k in range(len(word)):
@@ -99,14 +187,84 @@ class CrosswordCreator():
         Update `self.domains` such that each variable is node-consistent.
         (Remove any values that are inconsistent with a variable's unary
          constraints; in this case, the length of the word.)
+
+        Domains are built from words of the matching length in `__init__`,
+        so they are already node-consistent and nothing is left to remove.
+        """
+
+    def prune(self, var, values):
+        """
+        Remove `values` from `self.domains[var]`, recording the removal in
+        the current trail frame (if any) so it can be undone on backtrack.
+        """
+        if not values:
+            return
+        domain = self.domains[var]
+        domain -= values
+        positions = self.index[var]
+        if len(values) > len(domain):
+            # most of the domain is gone: build a fresh index from what is
+            # left and keep the old one to reinstate on undo
+            fresh = [dict() for _ in range(var.length)]
+            for value in domain:
+                for k, letter in enumerate(value):
+                    fresh[k].setdefault(letter, set()).add(value)
+            self.index[var] = fresh
+        else:
+            for value in values:
+                for k, letter in enumerate(value):
+                    words = positions[k][letter]
+                    words.discard(value)
+                    if not words:
+                        del positions[k][letter]
+            positions = None
+        if self.trail:
+            self.trail[-1].append((var, values, positions))
+        self.push_variable(var)
+
+    def undo(self):
+        """
+        Pop the most recent trail frame and restore every value it removed.
         """
-        for var in self.domains:
-            to_remove = set()
-            for value in self.domains[var]:
-                if len(value) != var.length:
-                    to_remove.add(value)
-            for value in to_remove:
-                self.domains[var].remove(value)
+        for var, values, positions in reversed(self.trail.pop()):
+            self.domains[var] |= values
+            if positions is not None:
+                self.index[var] = positions
+            else:
+                positions = self.index[var]
+                for value in values:
+                    for k, letter in enumerate(value):
+                        positions[k].setdefault(letter, set()).add(value)
+            self.push_variable(var)
+
+    def push_variable(self, var):
+        """
+        Push `var` onto the selection heap keyed by its current domain size.
+        """
+        heap = self._heap
+        heapq.heappush(
+            heap,
+            (len(self.domains[var]), -self._deg[var], next(self._tiebreak), var)
+        )
+        # stale entries only leave when they reach the top, so compact the
+        # heap once it outgrows a few entries per variable
+        if len(heap) > 4 * len(self._deg):
+            self.compact_heap()
+
+    def compact_heap(self):
+        """
+        Drop stale selection heap entries, keeping for each variable only
+        the oldest entry that matches its current domain size.
+        """
+        live = {}
+        for entry in self._heap:
+            size, _, tiebreak, var = entry
+            if size != len(self.domains[var]):
+                continue
+            if var not in live or tiebreak < live[var][2]:
+                live[var] = entry
+        self._heap[:] = live.values()
+        heapq.heapify(self._heap)
 
     def revise(self, x, y):
         """
@@ -117,19 +275,10 @@ class CrosswordCreator():
         Return True if a revision was made to the domain of `x`; return
         False if no revision was made.
         """
-        revised = False
-        overlap = self.crossword.overlaps.get((x, y))
-        if not overlap:
+        revise_arc = self._revise_fn.get((x, y))
+        if revise_arc is None:
             return False
-        i, j = overlap
-        to_remove = set()
-        for x_value in self.domains[x]:
-            if not any(x_value[i] == y_value[j] for y_value in self.domains[y]):
-                to_remove.add(x_value)
-        for x_value in to_remove:
-            self.domains[x].remove(x_value)
-            revised = True
-        return revised
+        return revise_arc()
 
     def ac3(self, arcs=None):
         """
@@ -142,18 +291,24 @@ class CrosswordCreator():
         """
         # change arcs to deque for efficient popleft
         if arcs is None:
-            arcs = collections.deque((x, y) for x in self.domains for y in self.domains if x != y)
+            # only overlapping pairs are constraints; overlaps holds both
+            # directions of each pair, so every arc is already included
+            arcs = collections.deque(
+                (x, y) for (x, y), overlap in self.crossword.overlaps.items()
+                if overlap is not None
+            )
         else:
             arcs = collections.deque(arcs)
         
         # revise each arc one at a time, add additional arcs to queue to ensure that other arcs stay consistent
         while arcs:
             x, y = arcs.popleft()
-            if self.revise(x, y):
+            revise_arc = self._revise_fn.get((x, y))
+            if revise_arc is not None and revise_arc():
                 if not self.domains[x]:
                     return False
                 # because we don't want to revise z anymore, x is put second in the tuple to not revise it
-                for z in self.crossword.neighbors(x) - set([y]):
+                for z in self._neighbors[x] - {y}:
                     arcs.append((z, x))
         return True
 
@@ -167,11 +322,28 @@ class CrosswordCreator():
                 return False
         return True
 
-    def consistent(self, assignment):
+    def consistent(self, assignment, var=None):
         """
         Return True if `assignment` is consistent (i.e., words fit in crossword
         puzzle without conflicting characters); return False otherwise.
+
+        If `var` is given, the rest of `assignment` is assumed to be
+        consistent already and only the constraints involving `var` are
+        checked.
         """
+        if var is not None:
+            value = assignment[var]
+            # `value` itself is in the assignment once; any more is a repeat
+            if operator.countOf(assignment.values(), value) > 1:
+                return False
+            if len(value) != var.length:
+                return False
+            for neighbor, i, j in self._constraints[var]:
+                if neighbor in assignment:
+                    if value[i] != assignment[neighbor][j]:
+                        return False
+            return True
+
         # check all values are distinct
         values = list(assignment.values())
         if len(values) != len(set(values)):
@@ -182,13 +354,10 @@ class CrosswordCreator():
             if len(value) != var.length:
                 return False
             # check for conflicts with neighboring variables
-            for neighbor in self.crossword.neighbors(var):
+            for neighbor, i, j in self._constraints[var]:
                 if neighbor in assignment:
-                    overlap = self.crossword.overlaps[var, neighbor]
-                    if overlap:
-                        i, j = overlap
-                        if value[i] != assignment[neighbor][j]:
-                            return False
+                    if value[i] != assignment[neighbor][j]:
+                        return False
         
         return True
 
@@ -199,19 +368,25 @@ class CrosswordCreator():
         The first value in the list, for example, should be the one
         that rules out the fewest values among the neighbors of `var`.
         """
+        # a value rules out every word of an unassigned neighbor that has a
+        # different letter at the overlap; tabulate that count per letter
+        # from the neighbor's index once, so each value only does lookups
+        columns = []
+        for neighbor, i, j in self._constraints[var]:
+            if neighbor not in assignment:
+                size = len(self.domains[neighbor])
+                conflicts = {
+                    letter: size - len(words)
+                    for letter, words in self.index[neighbor][j].items()
+                }
+                columns.append((i, size, conflicts))
+
         def count_conflicts(value):
-            conflicts = 0
-            for neighbor in self.crossword.neighbors(var):
-                # any var present in assignment already has a value and shouldn't be counted when computing the number of values ruled out for neighboring unassigned variables.
-                if neighbor not in assignment:
-                    overlap = self.crossword.overlaps[var, neighbor]
-                    if overlap:
-                        i, j = overlap
-                        for neighbor_val in self.domains[neighbor]:
-                            if value[i] != neighbor_val[j]:
-                                conflicts += 1
-            return conflicts
-        
+            return sum(
+                conflicts.get(value[i], size)
+                for i, size, conflicts in columns
+            )
+
         # return the domain values sorted by the number of conflicts they cause
         return sorted(self.domains[var], key = count_conflicts)
 
@@ -224,14 +399,42 @@ class CrosswordCreator():
         degree. If there is a tie, any of the tied variables are acceptable
         return values.
         """
-        unassigned = [var for var in self.crossword.variables if var not in assignment]
-        # function to calculate the number of remaining values (minimum remaining values MRV heuristic)
-        def mrv(var):
-            return len(self.domains[var])
-        # function to calculate the degree (number of neighbors)
-        def degree(var):
-            return len(self.crossword.neighbors(var))
-        return min(unassigned, key = lambda var: (mrv(var), -degree(var)))
+        heap = self._heap
+        while heap:
+            size, _, _, var = heap[0]
+            # skip entries for assigned variables or outdated domain sizes
+            if var in assignment or size != len(self.domains[var]):
+                heapq.heappop(heap)
+                continue
+            return var
+        # stale entries of since-unassigned variables may have been dropped
+        for var in self.crossword.variables:
+            if var not in assignment:
+                self.push_variable(var)
+        return heap[0][3]
+
+    def forward_check(self, assignment, var):
+        """
+        Remove from the domain of each unassigned neighbor of `var` the values
+        that disagree with `assignment[var]` at their overlap.
+
+        Return False if some neighbor's domain ends up empty; return True
+        otherwise.
+        """
+        value = assignment[var]
+        for neighbor, i, j in self._constraints[var]:
+            if neighbor in assignment:
+                continue
+            letter = value[i]
+            # every word of `neighbor` whose letter at `j` differs is ruled out
+            removed = set()
+            for other, words in self.index[neighbor][j].items():
+                if other != letter:
+                    removed |= words
+            self.prune(neighbor, removed)
+            if not self.domains[neighbor]:
+                return False
+        return True
 
     def backtrack(self, assignment):
         """
@@ -245,24 +448,41 @@ class CrosswordCreator():
         # if the assignment is complete, return it
         if self.assignment_complete(assignment):
             return assignment
-        # select an unsigned variable
+        # select an unsigned variable and order its domain values using the
+        # least-constraining value heuristic; the stack holds one
+        # (variable, remaining values) frame per decision level
         var = self.select_unassigned_variable(assignment)
-        # order domain values using the least-constraining value heuristic
-        for value in self.order_domain_values(var, assignment):
-            # create a copy of the assignment and add the variable
-            new_assignment = assignment.copy()
-            new_assignment[var] = value
-            # check if assignment is consistent
-            if self.consistent(new_assignment):
-                # apply AC3 to maintain arc consistency
-                if self.ac3([(var, neighbor) for neighbor in self.crossword.neighbors(var)]):
-                    result = self.backtrack(new_assignment)
-                    if result:
-                        return result
+        stack = [(var, iter(self.order_domain_values(var, assignment)))]
+        while stack:
+            var, values = stack[-1]
+            for value in values:
+                # extend the assignment in place; it is undone on failure
+                assignment[var] = value
+                # the rest was already consistent, so only check the new variable
+                if self.consistent(assignment, var):
+                    # open a trail frame so pruning below can be undone
+                    self.trail.append([])
+                    if self.forward_check(assignment, var):
+                        break
+                    self.undo()
+                del assignment[var]
+            else:
+                # no value left for `var`: make it selectable once more and
+                # retract the value of the level above
+                stack.pop()
+                self.push_variable(var)
+                if stack:
+                    self.undo()
+                    del assignment[stack[-1][0]]
+                continue
+
+            # `var` was assigned, so descend to the next decision level
+            if self.assignment_complete(assignment):
+                return assignment
+            var = self.select_unassigned_variable(assignment)
+            stack.append((var, iter(self.order_domain_values(var, assignment))))
         return None
 
-        
-
 
 def main():
 